@@ -6,8 +6,23 @@ from flask import Flask, render_template, request, jsonify, send_file, session,
 from datetime import datetime, timedelta
 from functools import wraps
 import os
+import queue
+import threading
+import time
+import atexit
+import tempfile
+from concurrent.futures import Future, InvalidStateError, TimeoutError as FutureTimeoutError
 from werkzeug.security import generate_password_hash, check_password_hash
 from dotenv import load_dotenv
+import replication
+
+# Export colonnaire (Parquet / Arrow) si pyarrow est installé
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
 
 # Charger les variables du fichier .env
 load_dotenv()
@@ -21,11 +36,191 @@ app.config['SESSION_COOKIE_SECURE'] = True
 app.config['SESSION_COOKIE_HTTPONLY'] = True
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=24)
 
+# Réplication: 'primary', 'follower' ou vide (instance autonome)
+REPLICATION_ROLE = os.getenv('REPLICATION_ROLE', '').strip().lower()
+REPLICATION_DIR = os.getenv('REPLICATION_DIR', '/app/data/replication')
+REPLICATION_POLL_INTERVAL = float(os.getenv('REPLICATION_POLL_INTERVAL', '0.5'))
+REPLICATION_LOG_MAX_BYTES = int(os.getenv('REPLICATION_LOG_MAX_BYTES', str(64 * 1024 * 1024)))
+
+_log_shipper = None
+_follower = None
+
 def get_db_connection():
     conn = sqlite3.connect(DATABASE)
     conn.row_factory = sqlite3.Row
     return conn
 
+def execute_write(cursor, sql, params=()):
+    """Exécuter une écriture et l'enregistrer dans le journal de réplication (primaire)"""
+    cursor.execute(sql, params)
+    result = (cursor.lastrowid, cursor.rowcount)
+    if _log_shipper is not None:
+        replication.record(cursor, sql, params, *result)
+    return result
+
+def ship_log(conn=None):
+    """Expédier les écritures validées vers le journal partagé (primaire)"""
+    if _log_shipper is None:
+        return
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+    try:
+        _log_shipper.ship(conn)
+    except Exception as e:
+        # Les entrées restent en base et seront expédiées au prochain appel
+        app.logger.error(f"Erreur d'expédition du journal de réplication: {e}")
+    finally:
+        if own_conn:
+            conn.close()
+
+# File d'écriture pour les changements (false: une connexion et un commit par requête)
+WRITE_QUEUE_ENABLED = os.getenv('WRITE_QUEUE_ENABLED', 'true').strip().lower() not in ('0', 'false', 'no')
+# Fenêtre de regroupement des écritures (en millisecondes)
+WRITE_BATCH_WINDOW_MS = float(os.getenv('WRITE_BATCH_WINDOW_MS', '2'))
+WRITE_BATCH_MAX_SIZE = int(os.getenv('WRITE_BATCH_MAX_SIZE', '256'))
+# Délai maximal d'attente d'une écriture en file (en secondes)
+WRITE_QUEUE_TIMEOUT = float(os.getenv('WRITE_QUEUE_TIMEOUT', '30'))
+
+class WriteQueue:
+    """File d'écriture unique: regroupe les écritures concurrentes dans une seule transaction"""
+
+    def __init__(self, database, window_ms=WRITE_BATCH_WINDOW_MS, max_batch=WRITE_BATCH_MAX_SIZE,
+                 timeout=WRITE_QUEUE_TIMEOUT):
+        self.database = database
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='write-queue', daemon=True)
+        self._thread.start()
+
+    def submit(self, sql, params=()):
+        """Mettre une requête en file et retourner un Future (lastrowid, rowcount)"""
+        future = Future()
+        self._queue.put((sql, params, future))
+        return future
+
+    def execute(self, sql, params=()):
+        """Exécuter une requête via la file et attendre son résultat (délai borné)"""
+        future = self.submit(sql, params)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # Annuler l'écriture pour qu'elle ne soit jamais exécutée après la réponse d'erreur
+            if future.cancel():
+                raise TimeoutError(f"Délai d'écriture dépassé ({self.timeout:g} s)") from None
+            # Écriture déjà en cours dans une transaction: attendre son résultat
+            return future.result()
+
+    def close(self):
+        """Vider la file puis arrêter le thread d'écriture"""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _next_batch(self):
+        # Attendre la première écriture, puis collecter celles qui arrivent pendant la fenêtre
+        item = self._queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Remettre le signal d'arrêt pour le prochain tour
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        conn = sqlite3.connect(self.database, isolation_level=None)
+        try:
+            while True:
+                batch = self._next_batch()
+                if batch is None:
+                    break
+                try:
+                    self._write_batch(conn, batch)
+                except Exception as e:
+                    # Ne jamais laisser mourir le thread: chaque requête en attente reçoit l'erreur
+                    app.logger.error(f"Erreur du thread d'écriture: {e}")
+                    for sql, params, future in batch:
+                        try:
+                            future.set_exception(e)
+                        except InvalidStateError:
+                            # Déjà résolue ou annulée
+                            pass
+        finally:
+            conn.close()
+
+    def _write_batch(self, conn, batch):
+        results = []
+        active = None
+        try:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            # Écarter les écritures annulées (délai dépassé) une fois le verrou obtenu
+            active = [item for item in batch if item[2].set_running_or_notify_cancel()]
+            for sql, params, future in active:
+                # Un savepoint par requête: une erreur n'annule que sa propre écriture
+                cursor.execute('SAVEPOINT item')
+                try:
+                    results.append((future, execute_write(cursor, sql, params), None))
+                    cursor.execute('RELEASE item')
+                except Exception as e:
+                    cursor.execute('ROLLBACK TO item')
+                    cursor.execute('RELEASE item')
+                    results.append((future, None, e))
+            cursor.execute('COMMIT')
+        except Exception as e:
+            # Échec de la transaction entière: chaque requête reçoit l'erreur
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            if active is None:
+                active = [item for item in batch if item[2].set_running_or_notify_cancel()]
+            for sql, params, future in active:
+                future.set_exception(e)
+            return
+
+        ship_log(conn)
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+_write_queue = None
+_write_queue_lock = threading.Lock()
+
+def get_write_queue():
+    """Retourner la file d'écriture, démarrée au premier appel"""
+    global _write_queue
+    with _write_queue_lock:
+        if _write_queue is None:
+            _write_queue = WriteQueue(DATABASE)
+            atexit.register(_write_queue.close)
+        return _write_queue
+
+def write_change(sql, params=()):
+    """Exécuter une écriture sur les changements: via la file, ou directement si elle est désactivée"""
+    if WRITE_QUEUE_ENABLED:
+        return get_write_queue().execute(sql, params)
+    
+    conn = get_db_connection()
+    try:
+        result = execute_write(conn.cursor(), sql, params)
+        conn.commit()
+        ship_log(conn)
+        return result
+    finally:
+        conn.close()
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -34,6 +229,15 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def primary_only(f):
+    """Refuser les écritures sur une instance suiveuse (lecture seule)"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if REPLICATION_ROLE == 'follower':
+            return jsonify({'error': 'Instance suiveuse en lecture seule'}), 503
+        return f(*args, **kwargs)
+    return decorated_function
+
 def init_db():
     if not os.path.exists(DATABASE):
         conn = get_db_connection()
@@ -143,6 +347,7 @@ def logout():
 
 @app.route('/api/change-password', methods=['POST'])
 @login_required
+@primary_only
 def change_password():
     """Changer le mot de passe de l'utilisateur connecté"""
     data = request.json
@@ -170,8 +375,9 @@ def change_password():
     
     # Mettre à jour le mot de passe
     new_password_hash = generate_password_hash(new_password)
-    cursor.execute('UPDATE users SET password = ? WHERE id = ?', (new_password_hash, session['user_id']))
+    execute_write(cursor, 'UPDATE users SET password = ? WHERE id = ?', (new_password_hash, session['user_id']))
     conn.commit()
+    ship_log(conn)
     conn.close()
     
     return jsonify({'success': True, 'message': 'Mot de passe modifié avec succès'})
@@ -198,6 +404,7 @@ def get_types():
 
 @app.route('/api/add-type', methods=['POST'])
 @login_required
+@primary_only
 def add_type():
     """Ajouter un nouveau type de produit ou changement"""
     data = request.json
@@ -215,11 +422,12 @@ def add_type():
     
     try:
         if type_category == 'product':
-            cursor.execute('INSERT INTO products (name) VALUES (?)', (name,))
+            execute_write(cursor, 'INSERT INTO products (name) VALUES (?)', (name,))
         else:
-            cursor.execute('INSERT INTO change_types (name) VALUES (?)', (name,))
+            execute_write(cursor, 'INSERT INTO change_types (name) VALUES (?)', (name,))
         
         conn.commit()
+        ship_log(conn)
         conn.close()
         
         return jsonify({'success': True, 'message': 'Type ajouté avec succès'})
@@ -232,6 +440,7 @@ def add_type():
 
 @app.route('/api/delete-type', methods=['POST'])
 @login_required
+@primary_only
 def delete_type():
     """Supprimer un type de produit ou changement"""
     data = request.json
@@ -249,11 +458,12 @@ def delete_type():
     
     try:
         if type_category == 'product':
-            cursor.execute('DELETE FROM products WHERE name = ?', (name,))
+            execute_write(cursor, 'DELETE FROM products WHERE name = ?', (name,))
         else:
-            cursor.execute('DELETE FROM change_types WHERE name = ?', (name,))
+            execute_write(cursor, 'DELETE FROM change_types WHERE name = ?', (name,))
         
         conn.commit()
+        ship_log(conn)
         conn.close()
         
         return jsonify({'success': True, 'message': 'Type supprimé avec succès'})
@@ -268,13 +478,21 @@ def get_changes():
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    # Filtres
-    product_type = request.args.get('product_type')
-    change_type = request.args.get('change_type')
-    designation = request.args.get('designation')
-    analyst = request.args.get('analyst')
-    date_from = request.args.get('date_from')
-    date_to = request.args.get('date_to')
+    query, params = build_changes_query(request.args)
+    cursor.execute(query, params)
+    changes = [dict(row) for row in cursor.fetchall()]
+    conn.close()
+    
+    return jsonify(changes)
+
+def build_changes_query(args):
+    """Construire la requête filtrée des changements (filtres de /api/changes)"""
+    product_type = args.get('product_type')
+    change_type = args.get('change_type')
+    designation = args.get('designation')
+    analyst = args.get('analyst')
+    date_from = args.get('date_from')
+    date_to = args.get('date_to')
     
     query = 'SELECT * FROM changes WHERE 1=1'
     params = []
@@ -305,45 +523,48 @@ def get_changes():
     
     query += ' ORDER BY date DESC'
     
-    cursor.execute(query, params)
-    changes = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    
-    return jsonify(changes)
+    return query, params
 
 @app.route('/api/changes', methods=['POST'])
 @login_required
+@primary_only
 def add_change():
     data = request.json
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        INSERT INTO changes (date, product_type, change_type, designation, analyst, app_link)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (
-        data.get('date'),
-        data.get('product_type'),
-        data.get('change_type'),
-        data.get('designation'),
-        data.get('analyst'),
-        data.get('app_link', '')
-    ))
+    # Valider la date (format YYYY-MM-DD), comme l'import CSV
+    try:
+        datetime.strptime(data.get('date'), '%Y-%m-%d')
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Format de date invalide (utilisez YYYY-MM-DD)'}), 400
     
-    conn.commit()
-    conn.close()
+    # Insertion via la file d'écriture (regroupée avec les écritures concurrentes)
+    try:
+        lastrowid, _ = write_change('''
+            INSERT INTO changes (date, product_type, change_type, designation, analyst, app_link)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (
+            data.get('date'),
+            data.get('product_type'),
+            data.get('change_type'),
+            data.get('designation'),
+            data.get('analyst'),
+            data.get('app_link', '')
+        ))
+    except sqlite3.IntegrityError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
     
-    return jsonify({'success': True, 'id': cursor.lastrowid}), 201
+    return jsonify({'success': True, 'id': lastrowid}), 201
 
 @app.route('/api/changes/<int:id>', methods=['DELETE'])
 @login_required
+@primary_only
 def delete_change(id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM changes WHERE id = ?', (id,))
-    conn.commit()
-    conn.close()
+    try:
+        write_change('DELETE FROM changes WHERE id = ?', (id,))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
     
     return jsonify({'success': True})
 
@@ -396,8 +617,118 @@ def export_csv():
     
     return response
 
+# Taille des lots (row groups) de l'export colonnaire
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '65536'))
+
+# Formats colonnaires: extension du fichier et type MIME
+EXPORT_FORMATS = {
+    'parquet': ('parquet', 'application/vnd.apache.parquet'),
+    'arrow': ('arrows', 'application/vnd.apache.arrow.stream')
+}
+
+def changes_arrow_schema():
+    """Schéma typé des changements (dates, catégories)"""
+    categorical = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ('id', pa.int64()),
+        ('date', pa.date32()),
+        # Texte d'origine des dates non ISO (anciennes lignes), null sinon
+        ('date_raw', pa.string()),
+        ('product_type', categorical),
+        ('change_type', categorical),
+        ('designation', pa.string()),
+        ('analyst', categorical),
+        ('app_link', pa.string()),
+        # CURRENT_TIMESTAMP de SQLite est en UTC; millisecondes: Parquet n'a pas d'unité seconde
+        ('created_at', pa.timestamp('ms', tz='UTC'))
+    ])
+
+def parse_timestamps(values, fmt):
+    """Convertir une colonne de dates texte en timestamps (null si invalide)"""
+    return pc.strptime(pa.array(values, type=pa.string()), format=fmt, unit='s', error_is_null=True)
+
+def changes_record_batch(rows, schema):
+    """Convertir un lot de lignes SQLite en RecordBatch Arrow"""
+    columns = dict(zip(rows[0].keys(), zip(*rows)))
+    
+    def categorical(name):
+        return pa.array(columns[name], type=pa.string()).dictionary_encode()
+    
+    raw_dates = pa.array(columns['date'], type=pa.string())
+    dates = parse_timestamps(raw_dates, '%Y-%m-%d').cast(pa.date32())
+    created_at = parse_timestamps(columns['created_at'], '%Y-%m-%d %H:%M:%S').cast(schema.field('created_at').type)
+    
+    invalid_created_at = created_at.null_count - columns['created_at'].count(None)
+    if invalid_created_at:
+        app.logger.warning(f"Export: {invalid_created_at} valeur(s) created_at illisible(s) exportée(s) à null")
+    
+    arrays = [
+        pa.array(columns['id'], type=pa.int64()),
+        dates,
+        pc.if_else(dates.is_null(), raw_dates, pa.scalar(None, type=pa.string())),
+        categorical('product_type'),
+        categorical('change_type'),
+        pa.array(columns['designation'], type=pa.string()),
+        categorical('analyst'),
+        pa.array([link or None for link in columns['app_link']], type=pa.string()),
+        created_at
+    ]
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+@app.route('/api/export', methods=['GET'])
+@login_required
+def export_columnar():
+    """Exporter les changements filtrés en Parquet ou Arrow IPC (flux)"""
+    export_format = request.args.get('format', 'parquet')
+    
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': 'Format invalide (parquet ou arrow)'}), 400
+    
+    if pa is None:
+        return jsonify({'error': "Export indisponible: pyarrow n'est pas installé"}), 501
+    
+    extension, mimetype = EXPORT_FORMATS[export_format]
+    schema = changes_arrow_schema()
+    query, params = build_changes_query(request.args)
+    
+    # Écriture par lots depuis le curseur: la mémoire reste bornée
+    output = tempfile.TemporaryFile()
+    conn = get_db_connection()
+    
+    try:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        
+        if export_format == 'parquet':
+            writer = pq.ParquetWriter(output, schema)
+        else:
+            writer = pa.ipc.new_stream(output, schema)
+        
+        with writer:
+            while True:
+                rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+                if not rows:
+                    break
+                writer.write_batch(changes_record_batch(rows, schema))
+    
+    except Exception as e:
+        output.close()
+        return jsonify({'error': f"Erreur lors de l'export: {str(e)}"}), 500
+    
+    finally:
+        conn.close()
+    
+    output.seek(0)
+    return send_file(
+        output,
+        mimetype=mimetype,
+        as_attachment=True,
+        download_name=f"inventaire_changements_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+    )
+
 @app.route('/api/import-csv', methods=['POST'])
 @login_required
+@primary_only
 def import_csv():
     """Importer des changements depuis un fichier CSV"""
     
@@ -463,7 +794,7 @@ def import_csv():
                     continue
                 
                 # Insérer dans la base de données
-                cursor.execute('''
+                execute_write(cursor, '''
                     INSERT INTO changes (date, product_type, change_type, designation, analyst, app_link)
                     VALUES (?, ?, ?, ?, ?, ?)
                 ''', (date, product_type, change_type, designation, analyst, app_link if app_link else None))
@@ -475,6 +806,7 @@ def import_csv():
         
         # Valider et sauvegarder
         conn.commit()
+        ship_log(conn)
         conn.close()
         
         return jsonify({
@@ -487,6 +819,52 @@ def import_csv():
     except Exception as e:
         return jsonify({'error': f'Erreur lors du traitement du fichier: {str(e)}'}), 500
 
+@app.route('/api/replication/status', methods=['GET'])
+@login_required
+def replication_status():
+    """État de la réplication (rôle, séquences, retard du suiveur)"""
+    if _follower is not None:
+        return jsonify(_follower.status())
+    
+    if _log_shipper is not None:
+        conn = get_db_connection()
+        last_seq = replication.last_logged_seq(conn)
+        conn.close()
+        return jsonify({
+            'role': 'primary',
+            'last_seq': last_seq,
+            'shipped_seq': _log_shipper.last_shipped
+        })
+    
+    return jsonify({'role': 'standalone'})
+
+def init_replication():
+    """Démarrer la réplication selon REPLICATION_ROLE"""
+    global _log_shipper, _follower
+    
+    if REPLICATION_ROLE == 'primary':
+        shipper = replication.LogShipper(REPLICATION_DIR, DATABASE, REPLICATION_LOG_MAX_BYTES)
+        conn = get_db_connection()
+        try:
+            replication.ensure_log_table(conn)
+            # Rattraper les entrées validées mais pas encore expédiées
+            shipper.ship(conn)
+            shipper.compact(conn)
+        finally:
+            conn.close()
+        # Nouvel instantané et nouveau segment à chaque démarrage
+        shipper.rotate()
+        _log_shipper = shipper
+    
+    elif REPLICATION_ROLE == 'follower':
+        _follower = replication.Follower(DATABASE, REPLICATION_DIR, REPLICATION_POLL_INTERVAL).start()
+    
+    elif REPLICATION_ROLE:
+        raise ValueError(f"REPLICATION_ROLE invalide: {REPLICATION_ROLE} (primary, follower ou vide)")
+
 if __name__ == '__main__':
-    init_db()
-    app.run(debug=False, host='0.0.0.0', port=5000)
+    # Un suiveur part de l'instantané du primaire, pas d'une base neuve
+    if REPLICATION_ROLE != 'follower':
+        init_db()
+    init_replication()
+    app.run(debug=False, host='0.0.0.0', port=int(os.getenv('PORT', '5000')))
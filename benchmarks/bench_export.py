@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Benchmark des exports - Inventaire des changements SOC
+Compare l'export CSV (/api/export-csv) aux exports colonnaires
+(/api/export?format=parquet|arrow): taille du fichier, durée de l'export
+et durée de chargement dans pandas.
+
+Usage: python benchmarks/bench_export.py [nombre_de_lignes]
+"""
+
+import io
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+# La base doit être choisie avant l'import de l'application
+TMP_DIR = tempfile.mkdtemp(prefix='soctrace-bench-')
+os.environ['DATABASE'] = os.path.join(TMP_DIR, 'inventory.db')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd  # noqa: E402
+import pyarrow as pa  # noqa: E402
+
+import app as soctrace  # noqa: E402
+
+PRODUCTS = ['Harfanglab', 'Elastic', 'Docker', 'Autre']
+CHANGE_TYPES = ['IOC', 'Whitelist', 'Règle', 'Autre']
+ANALYSTS = [f'Analyste {i}' for i in range(20)]
+
+
+def populate(count):
+    """Remplir la base avec des changements aléatoires"""
+    soctrace.init_db()
+    rng = random.Random(42)
+    conn = sqlite3.connect(soctrace.DATABASE)
+    conn.executemany('''
+        INSERT INTO changes (date, product_type, change_type, designation, analyst, app_link)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (
+        (
+            f'2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+            rng.choice(PRODUCTS),
+            rng.choice(CHANGE_TYPES),
+            f'Ajout IOC {rng.getrandbits(64):016x}',
+            rng.choice(ANALYSTS),
+            f'https://exemple.com/{i}' if i % 3 else ''
+        )
+        for i in range(count)
+    ))
+    conn.commit()
+    conn.close()
+
+
+def load_csv(data):
+    return pd.read_csv(io.BytesIO(data), parse_dates=['Date'])
+
+
+def load_parquet(data):
+    # Sans dtype_backend, pandas charge les colonnes date32 en objets datetime.date
+    return pd.read_parquet(io.BytesIO(data), dtype_backend='pyarrow')
+
+
+def load_arrow(data):
+    return pa.ipc.open_stream(data).read_all().to_pandas(types_mapper=pd.ArrowDtype)
+
+
+def timed(func, *args, repeat=3):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    populate(count)
+
+    client = soctrace.app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+
+    print(f"📊 {count} changements\n")
+    print(f"{'format':>8} {'taille':>10} {'export':>9} {'chargement':>11}  types")
+
+    cases = (
+        ('csv', '/api/export-csv', load_csv),
+        ('parquet', '/api/export?format=parquet', load_parquet),
+        ('arrow', '/api/export?format=arrow', load_arrow)
+    )
+    for name, url, loader in cases:
+        export_time, response = timed(lambda: client.get(url), repeat=1)
+        assert response.status_code == 200, response.data
+        data = response.data
+        load_time, frame = timed(loader, data)
+        assert len(frame) == count
+        date_column = 'Date' if name == 'csv' else 'date'
+        dtypes = ', '.join(f'{column}={frame[column].dtype}' for column in (date_column, frame.columns[-1]))
+        print(f"{name:>8} {len(data) / 1e6:8.2f} Mo {export_time:7.2f} s {load_time:9.3f} s  {dtypes}")
+
+
+if __name__ == '__main__':
+    main()
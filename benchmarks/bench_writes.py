@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Benchmark des écritures concurrentes - Inventaire des changements SOC
+Compare le débit de POST /api/changes (route complète: JSON, validation,
+primary_only, journal de réplication) sous charge concurrente:
+- direct: WRITE_QUEUE_ENABLED désactivé, une connexion et un commit par requête
+- file: file d'écriture unique qui regroupe les insertions concurrentes
+
+Usage: python benchmarks/bench_writes.py [clients] [insertions_par_client]
+"""
+
+import os
+import sys
+import sqlite3
+import tempfile
+import threading
+import time
+
+# La base doit être choisie avant l'import de l'application
+TMP_DIR = tempfile.mkdtemp(prefix='soctrace-bench-')
+os.environ['DATABASE'] = os.path.join(TMP_DIR, 'inventory.db')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as soctrace  # noqa: E402
+
+
+def make_change(client, i):
+    return {
+        'date': '2024-02-17',
+        'product_type': 'Elastic',
+        'change_type': 'IOC',
+        'designation': f'IOC {client}-{i}',
+        'analyst': f'analyste-{client}',
+        'app_link': ''
+    }
+
+
+def reset_db():
+    """Repartir d'une base vide"""
+    for suffix in ('', '-journal', '-wal', '-shm'):
+        path = soctrace.DATABASE + suffix
+        if os.path.exists(path):
+            os.remove(path)
+    soctrace.init_db()
+
+
+def run(clients, per_client):
+    ids = []
+    errors = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(clients + 1)
+
+    def worker(client_id):
+        # Un client HTTP (et une session) par thread
+        client = soctrace.app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = 1
+        barrier.wait()
+        for i in range(per_client):
+            response = client.post('/api/changes', json=make_change(client_id, i))
+            with lock:
+                if response.status_code == 201:
+                    ids.append(response.json['id'])
+                else:
+                    errors.append(f"{response.status_code} {response.get_data(as_text=True)}")
+
+    threads = [threading.Thread(target=worker, args=(c,)) for c in range(clients)]
+    for t in threads:
+        t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    conn = sqlite3.connect(soctrace.DATABASE)
+    stored = conn.execute('SELECT COUNT(*) FROM changes').fetchone()[0]
+    conn.close()
+    return elapsed, ids, errors, stored
+
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    per_client = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    total = clients * per_client
+
+    print(f"📊 {clients} clients x {per_client} POST /api/changes = {total} écritures")
+    print(f"   Fenêtre de regroupement: {soctrace.WRITE_BATCH_WINDOW_MS} ms\n")
+
+    for name, queue_enabled in (('direct', False), ('file', True)):
+        soctrace.WRITE_QUEUE_ENABLED = queue_enabled
+        reset_db()
+        elapsed, ids, errors, stored = run(clients, per_client)
+        unique = len(set(ids))
+        print(f"{name:>6}: {elapsed:7.2f} s  {len(ids) / elapsed:9.0f} écritures/s  "
+              f"ids uniques: {unique}/{total}  en base: {stored}  erreurs: {len(errors)}")
+        if errors:
+            print(f"        ex: {errors[0]}")
+
+
+if __name__ == '__main__':
+    main()
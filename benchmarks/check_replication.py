@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Vérification de la réplication sur un seul hôte - Inventaire des changements SOC
+Lance un primaire et un suiveur dans des processus séparés (répertoire local
+partagé) et vérifie que:
+- le suiveur rattrape le primaire (lag_entries revient à 0), en direct, après
+  un redémarrage (rejeu du journal) et après des rotations qui l'obligent à
+  repartir de l'instantané;
+- les lignes du suiveur sont identiques à celles du primaire (id, created_at...);
+- les écritures sur le suiveur répondent 503;
+- le primaire ne garde pas les entrées expédiées dans replication_log;
+- une ligne incomplète laissée par un arrêt brutal du primaire est retirée
+  au redémarrage.
+
+Usage: python benchmarks/check_replication.py
+"""
+
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TABLES = ['users', 'changes', 'products', 'change_types']
+
+
+def client_for(soctrace):
+    client = soctrace.app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+    return client
+
+
+def run_primary(start, count):
+    """Écritures sur le primaire (insertions, suppressions, types, mot de passe)"""
+    import app as soctrace
+    soctrace.init_db()
+    soctrace.init_replication()
+    client = client_for(soctrace)
+
+    for i in range(start, start + count):
+        response = client.post('/api/changes', json={
+            'date': f'2024-02-{i % 28 + 1:02d}',
+            'product_type': 'Elastic',
+            'change_type': 'IOC',
+            'designation': f'IOC {i}',
+            'analyst': 'Analyste',
+            'app_link': ''
+        })
+        assert response.status_code == 201, response.data
+    client.delete(f'/api/changes/{start + 1}')
+    if start == 0:
+        response = client.post('/api/change-password', json={
+            'current_password': os.getenv('DEFAULT_PASSWORD', 'Spluk2024!'),
+            'new_password': 'nouveau-mot-de-passe'
+        })
+        assert response.status_code == 200, response.data
+    client.post('/api/add-type', json={'type': 'product', 'name': f'Produit {start}'})
+    client.post('/api/delete-type', json={'type': 'changement', 'name': 'Autre'})
+
+    soctrace.get_write_queue().close()
+    print(json.dumps(client.get('/api/replication/status').json))
+
+
+def run_follower():
+    """Appliquer le journal jusqu'à la séquence lue sur stdin, puis tester une écriture"""
+    import app as soctrace
+    soctrace.init_replication()
+    client = client_for(soctrace)
+
+    # Le suiveur applique le journal en arrière-plan pendant que le primaire écrit
+    target_seq = int(sys.stdin.readline())
+
+    deadline = time.monotonic() + 20
+    status = client.get('/api/replication/status').json
+    while status['applied_seq'] < target_seq or status['lag_entries'] != 0:
+        assert status['error'] is None, status['error']
+        assert time.monotonic() < deadline, f"Le suiveur n'a pas rattrapé le primaire: {status}"
+        time.sleep(0.1)
+        status = client.get('/api/replication/status').json
+
+    write_status = client.post('/api/changes', json={'date': '2024-02-17'}).status_code
+    soctrace._follower.stop()
+    print(json.dumps({'status': status, 'write_status': write_status}))
+
+
+def spawn(env, *args):
+    return subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), *map(str, args)],
+        env=env, cwd=ROOT, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True
+    )
+
+
+def finish(process, target_seq=None):
+    stdin = f'{target_seq}\n' if target_seq is not None else None
+    output, _ = process.communicate(stdin, timeout=60)
+    if process.returncode != 0:
+        sys.exit(f"❌ Processus en échec ({process.args[2:]})")
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def dump(database, table):
+    conn = sqlite3.connect(database)
+    rows = conn.execute(f'SELECT * FROM {table} ORDER BY rowid').fetchall()
+    conn.close()
+    return rows
+
+
+def check(condition, message):
+    print(f"{'✅' if condition else '❌'} {message}")
+    if not condition:
+        sys.exit(1)
+
+
+def main():
+    tmp_dir = tempfile.mkdtemp(prefix='soctrace-replication-')
+    base_env = dict(
+        os.environ,
+        REPLICATION_DIR=os.path.join(tmp_dir, 'replication'),
+        REPLICATION_POLL_INTERVAL='0.1',
+        # Petits segments pour provoquer des rotations pendant la vérification
+        REPLICATION_LOG_MAX_BYTES='4000'
+    )
+    primary_db = os.path.join(tmp_dir, 'primary.db')
+    follower_db = os.path.join(tmp_dir, 'follower.db')
+    primary_env = dict(base_env, REPLICATION_ROLE='primary', DATABASE=primary_db)
+    follower_env = dict(base_env, REPLICATION_ROLE='follower', DATABASE=follower_db)
+
+    def follow(target_seq, follower=None):
+        result = finish(follower or spawn(follower_env, 'follower'), target_seq)
+        status = result['status']
+        check(status['applied_seq'] == target_seq and status['lag_entries'] == 0,
+              f"Suiveur à jour (séquence {status['applied_seq']}), lag_entries à 0")
+        check(result['write_status'] == 503, "Écriture refusée sur le suiveur (503)")
+        for table in TABLES:
+            primary_rows = dump(primary_db, table)
+            check(primary_rows == dump(follower_db, table),
+                  f"Table {table} identique ({len(primary_rows)} lignes)")
+
+    # 1. Le primaire écrit avant l'arrivée du suiveur (amorçage par instantané)
+    finish(spawn(primary_env, 'primary', 0, 20))
+
+    print("— Suiveur en direct pendant les écritures (rotations du journal)")
+    follower = spawn(follower_env, 'follower')
+    primary_status = finish(spawn(primary_env, 'primary', 100, 40))
+    follow(primary_status['last_seq'], follower)
+
+    print("— Redémarrage du suiveur plus tard: le rejeu ne recalcule pas created_at")
+    # Simuler un arrêt brutal du primaire au milieu d'une écriture du journal:
+    # une écriture validée mais pas encore expédiée, et une ligne incomplète
+    import replication
+    conn = sqlite3.connect(primary_db)
+    cursor = conn.cursor()
+    sql, params = 'INSERT INTO products (name) VALUES (?)', ('Produit avant arrêt',)
+    cursor.execute(sql, params)
+    replication.record(cursor, sql, params, cursor.lastrowid, cursor.rowcount)
+    conn.commit()
+    conn.close()
+    last_segment = sorted(
+        name for name in os.listdir(base_env['REPLICATION_DIR']) if name.startswith('changes-')
+    )[-1]
+    with open(os.path.join(base_env['REPLICATION_DIR'], last_segment), 'a', encoding='utf-8') as f:
+        f.write('{"seq": 999999, "committed_at": 0, "sql": "INSE')
+    primary_status = finish(spawn(primary_env, 'primary', 200, 5))
+    time.sleep(1.5)
+    follow(primary_status['last_seq'])
+
+    print("— Suiveur arrêté pendant plusieurs rotations: reprise depuis l'instantané")
+    primary_status = finish(spawn(primary_env, 'primary', 300, 40))
+    follow(primary_status['last_seq'])
+
+    print("— Primaire")
+    check(dump(primary_db, 'replication_log') == [], "replication_log compacté sur le primaire")
+    segments = [name for name in os.listdir(base_env['REPLICATION_DIR']) if name.startswith('changes-')]
+    check(len(segments) <= 2, f"Rotation du journal ({len(segments)} segment(s) conservé(s))")
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, ROOT)
+    if len(sys.argv) > 1 and sys.argv[1] == 'primary':
+        run_primary(int(sys.argv[2]), int(sys.argv[3]))
+    elif len(sys.argv) > 1 and sys.argv[1] == 'follower':
+        run_follower()
+    else:
+        main()
@@ -0,0 +1,411 @@
+"""
+Réplication par journal - Inventaire des changements SOC
+- Primaire: chaque écriture validée est enregistrée dans la table replication_log
+  (dans la même transaction), puis expédiée dans un journal ordonné découpé en
+  segments (changes-<seq>.log, une entrée JSON par ligne) dans le répertoire
+  partagé. Les insertions sont journalisées avec les valeurs réelles de la
+  ligne (id, created_at...) pour que le suiveur obtienne des lignes identiques.
+- Rotation: au démarrage du primaire et quand le segment courant dépasse
+  max_bytes, un nouvel instantané est écrit et un nouveau segment commence.
+  Seul le dernier segment fermé est conservé pour les suiveurs en retard.
+- Suiveur: part d'un instantané de la base primaire, puis applique le journal
+  dans l'ordre sur sa propre copie locale et expose son retard.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+SEGMENT_PATTERN = re.compile(r'^changes-(\d+)\.log$')
+SNAPSHOT_FILENAME = 'snapshot.db'
+INSERT_PATTERN = re.compile(r'^\s*INSERT\s+(?:OR\s+\w+\s+)?INTO\s+(\w+)', re.IGNORECASE)
+
+
+class ReplicationError(Exception):
+    """Erreur de réplication (instantané absent, trou dans le journal...)"""
+
+
+def ensure_log_table(conn):
+    """Créer la table du journal de réplication sur le primaire"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS replication_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            committed_at REAL NOT NULL,
+            sql TEXT NOT NULL,
+            params TEXT NOT NULL
+        )
+    ''')
+    conn.commit()
+
+
+def resolve_statement(cursor, sql, params, lastrowid, rowcount):
+    """Remplacer une insertion par la ligne réellement écrite (valeurs par défaut comprises)"""
+    match = INSERT_PATTERN.match(sql)
+    if match is None:
+        return sql, list(params)
+    if rowcount != 1:
+        raise ReplicationError(f"Insertion de {rowcount} lignes non réplicable: {sql.strip()}")
+
+    table = match.group(1)
+    cursor.execute(f'SELECT * FROM {table} WHERE rowid = ?', (lastrowid,))
+    row = cursor.fetchone()
+    columns = [description[0] for description in cursor.description]
+    resolved_sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    return resolved_sql, list(row)
+
+
+def record(cursor, sql, params, lastrowid, rowcount):
+    """Enregistrer une écriture dans le journal, dans la transaction en cours"""
+    if rowcount == 0:
+        # Rien n'a changé (INSERT OR IGNORE ignoré, DELETE sans ligne...)
+        return
+    resolved_sql, resolved_params = resolve_statement(cursor, sql, params, lastrowid, rowcount)
+    cursor.execute(
+        'INSERT INTO replication_log (committed_at, sql, params) VALUES (?, ?, ?)',
+        (time.time(), resolved_sql, json.dumps(resolved_params))
+    )
+
+
+def last_logged_seq(conn):
+    """Dernier numéro de séquence attribué par le primaire"""
+    row = conn.execute(
+        "SELECT seq FROM sqlite_sequence WHERE name = 'replication_log'"
+    ).fetchone()
+    return row[0] if row else 0
+
+
+def list_segments(log_dir):
+    """Segments du journal, triés par première séquence: [(first_seq, chemin)]"""
+    if not os.path.isdir(log_dir):
+        return []
+    segments = []
+    for name in os.listdir(log_dir):
+        match = SEGMENT_PATTERN.match(name)
+        if match:
+            segments.append((int(match.group(1)), os.path.join(log_dir, name)))
+    return sorted(segments)
+
+
+def segment_path(log_dir, first_seq):
+    return os.path.join(log_dir, f'changes-{first_seq:012d}.log')
+
+
+def copy_database(src_path, dst_path):
+    """Copie cohérente d'une base SQLite (API de sauvegarde)"""
+    src = sqlite3.connect(src_path)
+    dst = sqlite3.connect(dst_path)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+class LogShipper:
+    """Expédie les entrées validées de replication_log vers le journal partagé"""
+
+    def __init__(self, log_dir, database, max_bytes=64 * 1024 * 1024):
+        self.log_dir = log_dir
+        self.database = database
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(log_dir, exist_ok=True)
+        segments = list_segments(log_dir)
+        self.segment_path = segments[-1][1] if segments else None
+        self.last_shipped = self._recover_segment(segments[-1][0]) if segments else 0
+
+    def _recover_segment(self, first_seq):
+        """Retirer une dernière ligne incomplète (arrêt brutal) et retourner la dernière séquence"""
+        with open(self.segment_path, 'rb+') as f:
+            data = f.read()
+            end = data.rfind(b'\n') + 1
+            if end < len(data):
+                # Les prochaines entrées ne doivent pas être collées à ce fragment
+                f.truncate(end)
+                f.flush()
+                os.fsync(f.fileno())
+        lines = data[:end].splitlines()
+        return json.loads(lines[-1])['seq'] if lines else first_seq - 1
+
+    def ship(self, conn):
+        """Ajouter au journal les entrées pas encore expédiées, puis les retirer de la base"""
+        with self._lock:
+            rows = conn.execute(
+                'SELECT seq, committed_at, sql, params FROM replication_log WHERE seq > ? ORDER BY seq',
+                (self.last_shipped,)
+            ).fetchall()
+            if not rows:
+                return 0
+
+            lines = ''.join(
+                json.dumps({
+                    'seq': seq,
+                    'committed_at': committed_at,
+                    'sql': sql,
+                    'params': json.loads(params)
+                }, ensure_ascii=False) + '\n'
+                for seq, committed_at, sql, params in rows
+            )
+            if self.segment_path is None:
+                self.segment_path = segment_path(self.log_dir, rows[0][0])
+            with open(self.segment_path, 'a', encoding='utf-8') as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+            self.last_shipped = rows[-1][0]
+
+            # Les entrées sont durables dans le journal: inutile de les garder en base
+            self._compact(conn)
+            if os.path.getsize(self.segment_path) >= self.max_bytes:
+                self._rotate()
+            return len(rows)
+
+    def compact(self, conn):
+        """Supprimer de la base les entrées déjà présentes dans le journal"""
+        with self._lock:
+            self._compact(conn)
+
+    def _compact(self, conn):
+        conn.execute('DELETE FROM replication_log WHERE seq <= ?', (self.last_shipped,))
+        conn.commit()
+
+    def rotate(self):
+        """Écrire un nouvel instantané et commencer un nouveau segment"""
+        with self._lock:
+            self._rotate()
+
+    def _rotate(self):
+        snapshot_path = os.path.join(self.log_dir, SNAPSHOT_FILENAME)
+        tmp_path = snapshot_path + '.tmp'
+        copy_database(self.database, tmp_path)
+        os.replace(tmp_path, snapshot_path)
+
+        # Garder le segment qui vient d'être fermé pour les suiveurs en retard
+        closed = self.segment_path
+        self.segment_path = None
+        for first_seq, path in list_segments(self.log_dir):
+            if path != closed:
+                os.remove(path)
+
+
+def snapshot_seq(log_dir):
+    """Séquence contenue dans l'instantané du primaire (0 s'il est absent)"""
+    snapshot_path = os.path.join(log_dir, SNAPSHOT_FILENAME)
+    if not os.path.exists(snapshot_path):
+        return 0
+    conn = sqlite3.connect(f'file:{snapshot_path}?mode=ro', uri=True)
+    try:
+        return last_logged_seq(conn)
+    finally:
+        conn.close()
+
+
+def bootstrap_follower(database, log_dir, resync=False):
+    """Préparer la base locale d'un suiveur (copie de l'instantané si absente ou si resync)"""
+    if resync or not os.path.exists(database):
+        snapshot_path = os.path.join(log_dir, SNAPSHOT_FILENAME)
+        if not os.path.exists(snapshot_path):
+            raise ReplicationError(
+                f"Instantané introuvable: {snapshot_path} (démarrez d'abord le primaire)"
+            )
+        copy_database(snapshot_path, database)
+
+    conn = sqlite3.connect(database)
+    try:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS replication_state (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                applied_seq INTEGER NOT NULL,
+                applied_at REAL
+            )
+        ''')
+        row = conn.execute('SELECT applied_seq FROM replication_state WHERE id = 1').fetchone()
+        if row is None:
+            # Tout ce que l'instantané contient est déjà appliqué
+            has_sequence = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_sequence'"
+            ).fetchone()
+            applied_seq = last_logged_seq(conn) if has_sequence else 0
+            conn.execute(
+                'INSERT INTO replication_state (id, applied_seq, applied_at) VALUES (1, ?, NULL)',
+                (applied_seq,)
+            )
+            conn.commit()
+            return applied_seq
+        return row[0]
+    finally:
+        conn.close()
+
+
+class Follower:
+    """Applique le journal du primaire sur la base locale, en arrière-plan"""
+
+    def __init__(self, database, log_dir, poll_interval=0.5):
+        self.database = database
+        self.log_dir = log_dir
+        self.poll_interval = poll_interval
+        self.applied_seq = bootstrap_follower(database, log_dir)
+        self.applied_at = None
+        self.primary_seq = self.applied_seq
+        self.last_error = None
+        self._segment = None
+        self._offset = 0
+        self._pending = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='replication-follower', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _read_new_entries(self):
+        segments = list_segments(self.log_dir)
+        if not segments:
+            return
+        if self._segment is None:
+            # Reprendre au segment qui contient la prochaine séquence à appliquer
+            candidates = [segment for segment in segments if segment[0] <= self.applied_seq + 1]
+            self._segment = candidates[-1] if candidates else segments[0]
+            self._offset = 0
+
+        while True:
+            later = [segment for segment in segments if segment[0] > self._segment[0]]
+            self._read_segment()
+            if not later:
+                return
+            # Un segment plus récent existe: le segment courant est fermé et lu en entier
+            self._segment = later[0]
+            self._offset = 0
+
+    def _read_segment(self):
+        # Lire uniquement les lignes complètes ajoutées depuis la dernière lecture
+        try:
+            with open(self._segment[1], 'rb') as f:
+                f.seek(self._offset)
+                data = f.read()
+        except FileNotFoundError:
+            # Segment supprimé par une rotation: un éventuel trou est détecté à l'application
+            return
+        end = data.rfind(b'\n')
+        if end < 0:
+            return
+        for line in data[:end].split(b'\n'):
+            try:
+                entry = json.loads(line)
+            except ValueError as e:
+                # L'offset reste sur la ligne illisible: rien n'est sauté en silence
+                raise ReplicationError(
+                    f"Entrée illisible dans {os.path.basename(self._segment[1])} "
+                    f"(octet {self._offset}): {e}"
+                ) from None
+            # Avancer uniquement des octets réellement consommés
+            self._offset += len(line) + 1
+            if entry['seq'] > self.applied_seq:
+                self._pending.append(entry)
+            self.primary_seq = max(self.primary_seq, entry['seq'])
+
+    def _apply_pending(self, conn):
+        if not self._pending:
+            return 0
+        expected = self.applied_seq + 1
+        if self._pending[0]['seq'] != expected:
+            raise ReplicationError(
+                f"Trou dans le journal: séquence {expected} attendue, {self._pending[0]['seq']} reçue"
+            )
+
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            for entry in self._pending:
+                cursor.execute(entry['sql'], entry['params'])
+            last = self._pending[-1]
+            now = time.time()
+            cursor.execute(
+                'UPDATE replication_state SET applied_seq = ?, applied_at = ? WHERE id = 1',
+                (last['seq'], now)
+            )
+            cursor.execute('COMMIT')
+        except Exception:
+            cursor.execute('ROLLBACK')
+            raise
+
+        applied = len(self._pending)
+        self.applied_seq = last['seq']
+        self.applied_at = now
+        self._pending = []
+        return applied
+
+    def poll(self, conn):
+        """Lire les nouvelles entrées du journal et les appliquer"""
+        with self._lock:
+            try:
+                read_error = None
+                try:
+                    self._read_new_entries()
+                except ReplicationError as e:
+                    # Appliquer quand même les entrées lues avant l'erreur
+                    read_error = e
+                if read_error is None and self._pending and self._pending[0]['seq'] != self.applied_seq + 1:
+                    self._resync()
+                    self._read_new_entries()
+                applied = self._apply_pending(conn)
+                if read_error is not None:
+                    raise read_error
+                self.last_error = None
+                return applied
+            except Exception as e:
+                self.last_error = str(e)
+                raise
+
+    def _resync(self):
+        # Les segments nécessaires ont été supprimés par une rotation: repartir du dernier instantané
+        if snapshot_seq(self.log_dir) <= self.applied_seq:
+            raise ReplicationError(
+                f"Trou dans le journal après la séquence {self.applied_seq} et aucun instantané plus récent"
+            )
+        self.applied_seq = bootstrap_follower(self.database, self.log_dir, resync=True)
+        self.primary_seq = max(self.primary_seq, self.applied_seq)
+        self._pending = []
+        self._segment = None
+        self._offset = 0
+
+    def _run(self):
+        conn = sqlite3.connect(self.database, isolation_level=None)
+        try:
+            while not self._stop.is_set():
+                try:
+                    self.poll(conn)
+                except Exception:
+                    # L'erreur est exposée par status(); on réessaie au prochain tour
+                    pass
+                self._stop.wait(self.poll_interval)
+        finally:
+            conn.close()
+
+    def status(self):
+        """État de la réplication et retard par rapport au primaire"""
+        with self._lock:
+            try:
+                self._read_new_entries()
+            except Exception as e:
+                self.last_error = str(e)
+            oldest = self._pending[0]['committed_at'] if self._pending else None
+            return {
+                'role': 'follower',
+                'applied_seq': self.applied_seq,
+                'primary_seq': self.primary_seq,
+                'lag_entries': self.primary_seq - self.applied_seq,
+                'lag_seconds': round(time.time() - oldest, 3) if oldest is not None else 0.0,
+                'applied_at': self.applied_at,
+                'error': self.last_error
+            }